@@ -6,13 +6,17 @@ TODOs:
 """
 # System imports
 import argparse
+import functools
 import os
+import queue
+import re
 import sys
-from collections import defaultdict
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Third-party imports
 import git
-from six import string_types
 from termcolor import colored
 
 
@@ -24,6 +28,16 @@ class CascadeException(Exception):
     pass
 
 
+# Serializes terminal output from concurrent cascade workers. Reentrant so a
+# worker can hold it across a block of prints that also call helpers below.
+_PRINT_LOCK = threading.RLock()
+
+
+def locked_print(*args, **kwargs):
+    with _PRINT_LOCK:
+        print(*args, **kwargs)
+
+
 def branch_name(branch):
     """
     Get the name of a branch object. Deals with a branch as a string.
@@ -33,12 +47,30 @@ def branch_name(branch):
     :return: String name of the branch.
     """
     assert branch is not None, "Must have a valid branch to get the name!"
-    if isinstance(branch, string_types):
+    if isinstance(branch, str):
         return branch
     name = branch.name.lstrip("./")
     return name
 
 
+def tracking_branch_name(branch, meta=None):
+    """
+    Get the name of the branch a branch tracks, preferring the lookup cached
+    by `build_git_dag` over asking GitPython to parse the git config again.
+
+    :input branch: GitPython Branch object. Can also be a string if meta is
+                   given.
+    :input meta: Optional branch metadata returned by `build_git_dag`.
+
+    :return: String name of the tracking branch, or None if there is none.
+    """
+    bname = branch_name(branch)
+    if meta is not None and bname in meta:
+        return meta[bname]["tracking"]
+    tb = branch.tracking_branch()
+    return branch_name(tb) if tb else None
+
+
 def commit_delta_by_branch_name(cur_branch_name, parent_branch_name, repo):
     cmd = [
         "git",
@@ -57,56 +89,150 @@ def commit_delta_by_branch_name(cur_branch_name, parent_branch_name, repo):
         return None, None
 
 
+_TRACK_PATTERN = re.compile(r"(ahead|behind) (\d+)")
+
+
+def build_ahead_behind_map(repo):
+    """
+    Get the commit delta of every local branch relative to its upstream with a
+    single `git for-each-ref` call, rather than one `git rev-list` per branch.
+
+    :input repo: GitPython repo object handle for dealing with git metadata.
+
+    :return: A dict of key, branch name, to tuple, (ahead, behind) commit
+             counts. Branches whose upstream is gone map to (None, None), like
+             `commit_delta_by_branch_name`. Branches without an upstream are
+             omitted.
+    """
+    ahead_behind = {}
+    if repo is None:
+        return ahead_behind
+    try:
+        out = repo.git.for_each_ref(
+            "--format=%(refname:lstrip=2)\t%(upstream:lstrip=2)\t%(upstream:track)", "refs/heads"
+        )
+    except git.GitCommandError:
+        return ahead_behind
+    for line in out.splitlines():
+        bname, upstream, track = (line.split("\t") + ["", ""])[:3]
+        if not upstream:
+            continue
+        if "gone" in track:
+            ahead_behind[bname] = (None, None)
+            continue
+        delta = dict(ahead=0, behind=0)
+        for key, count in _TRACK_PATTERN.findall(track):
+            delta[key] = int(count)
+        ahead_behind[bname] = (delta["ahead"], delta["behind"])
+    return ahead_behind
+
+
+def has_diverged(repo, branch1, branch2):
+    """
+    Check whether branch1 has commits that branch2 doesn't, without counting
+    them. `git merge-base --is-ancestor` stops walking history as soon as it
+    has an answer, where `git rev-list --count` always walks the full range.
+
+    :input repo: GitPython repo object handle for dealing with git metadata.
+
+    :return: True if branch1 is not an ancestor of branch2.
+    """
+    try:
+        repo.git.merge_base("--is-ancestor", branch1, branch2)
+    except git.GitCommandError as e:
+        # Exit code 1 is the "not an ancestor" answer, anything else is an
+        # actual failure such as a missing branch.
+        if e.status == 1:
+            return True
+        raise
+    return False
+
+
 def commit_delta_by_branch(cur_branch, repo):
     cur_branch_name = branch_name(cur_branch)
-    parent_branch_name = branch_name(cur_branch.tracking_branch())
+    parent_branch_name = tracking_branch_name(cur_branch)
     return commit_delta_by_branch_name(cur_branch_name, parent_branch_name, repo)
 
 
-def replace_colored(string, *args, **kwargs):
-    return string
+@functools.lru_cache(maxsize=None)
+def _color_codes():
+    """
+    Get the escapes termcolor wraps red and green text in, so
+    create_branch_str, which runs once per printed branch, doesn't go through
+    termcolor each time. They are empty when termcolor wouldn't color, e.g.
+    output isn't a tty or NO_COLOR is set.
+
+    :return: Tuple of (red, green, reset) strings.
+    """
+    red, _, reset = colored("\0", "red").partition("\0")
+    green, _, _ = colored("\0", "green").partition("\0")
+    return red, green, reset
+
+
+# Indentation for each tree depth, so printing doesn't rebuild it every time.
+_INDENT = [("  " * i) for i in range(64)]
 
 
-def create_branch_str(bname, active_branch, depth, parent_bname="", repo=None, no_color=False):
-    color_fn = colored
-    if no_color:
-        color_fn = replace_colored
+def create_branch_str(
+    bname,
+    active_branch,
+    depth,
+    parent_bname="",
+    repo=None,
+    no_color=False,
+    ahead_behind=None,
+    counts=True,
+):
+    red, green, reset = ("", "", "") if no_color else _color_codes()
     # Create a string with whitespace representing depth.
-    tabstr = "".join(["  "] * depth)
+    tabstr = _INDENT[depth] if depth < len(_INDENT) else "  " * depth
     if depth == 0:
-        branch_str = " {branch}".format(tabstr, branch=bname)
+        branch_str = f" {bname}"
     else:
-        branch_str = "{} |-> {branch}".format(tabstr, branch=bname)
+        branch_str = f"{tabstr} |-> {bname}"
 
     # If given enough information, print the status relative to the parent.
-    if parent_bname and repo:
-        (cur_ahead, parent_ahead) = commit_delta_by_branch_name(bname, parent_bname, repo)
-        branch_str += "  "
-        if parent_ahead:
-            parent_ahead_str = color_fn("-{}".format(str(parent_ahead)), "red")
-        elif parent_ahead == 0:
-            parent_ahead_str = "-{}".format(str(parent_ahead))
+    if parent_bname and repo and not counts:
+        # Only show whether the parent has moved on. Without the batched map,
+        # has_diverged answers that without counting every commit.
+        if ahead_behind and bname in ahead_behind:
+            behind = ahead_behind[bname][1]
+            if behind is not None:
+                behind = behind > 0
         else:
-            parent_ahead_str = "?"
-        if cur_ahead:
-            cur_ahead_str = color_fn("+{}".format(str(cur_ahead)), "green")
-        elif cur_ahead == 0:
-            cur_ahead_str = "-{}".format(str(cur_ahead))
+            try:
+                behind = has_diverged(repo, parent_bname, bname)
+            except git.GitCommandError:
+                behind = None
+        if behind is None:
+            branch_str = f"{red}{branch_str}  (Upstream Branch Not Found){reset}"
+        elif behind:
+            branch_str = f"{branch_str}  ({red}behind{reset})"
         else:
-            cur_ahead_str = "?"
-
+            branch_str = f"{branch_str}  (up to date)"
+    elif parent_bname and repo:
+        if ahead_behind and bname in ahead_behind:
+            (cur_ahead, parent_ahead) = ahead_behind[bname]
+        else:
+            (cur_ahead, parent_ahead) = commit_delta_by_branch_name(bname, parent_bname, repo)
         if cur_ahead is None or parent_ahead is None:
-            branch_str += "(Upstream Branch Not Found)"
-            branch_str = color_fn(branch_str, "red")
+            branch_str = f"{red}{branch_str}  (Upstream Branch Not Found){reset}"
         else:
-            branch_str += "({}, {})".format(parent_ahead_str, cur_ahead_str)
+            if parent_ahead:
+                parent_ahead_str = f"{red}-{parent_ahead}{reset}"
+            else:
+                parent_ahead_str = f"-{parent_ahead}"
+            if cur_ahead:
+                cur_ahead_str = f"{green}+{cur_ahead}{reset}"
+            else:
+                cur_ahead_str = f"-{cur_ahead}"
+            branch_str = f"{branch_str}  ({parent_ahead_str}, {cur_ahead_str})"
 
     # Highlight the current branch in terminal if it is currently checked
     # out.
     active_bname = branch_name(active_branch)
     if active_bname is not None and bname == active_bname:
-        branch_str += " *(active branch)"
-        branch_str = color_fn(branch_str, "green")
+        branch_str = f"{green}{branch_str} *(active branch){reset}"
     return branch_str
 
 
@@ -121,9 +247,37 @@ def active_branch_from_repo(repo, verbose=False):
         return None
 
 
+def remote_branch_is_current(branch, repo):
+    """
+    Check whether the local `origin/<branch>` ref already points at the tip
+    origin advertises, in which case fetching it would transfer nothing.
+
+    :input branch: GitPython Branch object. Can also be a string.
+    :input repo: GitPython repo object handle for dealing with git metadata.
+
+    :return: Boolean, True if `origin/<branch>` is up to date.
+    """
+    bname = branch_name(branch)
+    ref = "refs/heads/{}".format(bname)
+    remote_sha = None
+    for line in repo.git.ls_remote("--heads", "origin", ref).splitlines():
+        sha, _, name = line.partition("\t")
+        if name == ref:
+            remote_sha = sha
+    if remote_sha is None:
+        return False
+    try:
+        return repo.rev_parse("origin/{}".format(bname)).hexsha == remote_sha
+    except (git.BadName, ValueError):
+        return False
+
+
 def refresh_branch(branch, repo):
     try:
-        repo.remote().fetch(branch_name(branch))
+        if not remote_branch_is_current(branch, repo):
+            repo.remote().fetch(branch_name(branch))
+        # Reset even when nothing was fetched, the local branch may still be
+        # behind its remote-tracking ref.
         cmd = ["git", "reset", "--keep", "origin/{}".format(branch_name(branch))]
         repo.git.execute(cmd)
     except Exception as e:
@@ -154,8 +308,9 @@ def abort_reabse(repo: git.Repo) -> None:
     try:
         repo.git.rebase(abort=True)
     except git.GitCommandError as e:
-        print(colored("Skipping abort rebase since no rebase is in progress", "red"))
-        print(colored(str(e), "yellow"))
+        with _PRINT_LOCK:
+            print(colored("Skipping abort rebase since no rebase is in progress", "red"))
+            print(colored(str(e), "yellow"))
 
 
 def force_push_no_verify(repo: git.Repo, branch: str) -> None:
@@ -167,25 +322,26 @@ def force_push_no_verify(repo: git.Repo, branch: str) -> None:
     :input branch: String name of the branch to push.
     """
     try:
-        print(f"git push --force origin {branch} --no-verify")
+        locked_print(f"git push --force origin {branch} --no-verify")
         repo.git.push("--force", "origin", branch, "--no-verify")
     except git.GitCommandError as e:
-        print(colored("Failed to push branch due to error:", "red"))
-        print(colored(str(e), "yellow"))
-        print(
-            colored(
-                "Aborting cascade for this branch. "
-                "Please resolve conflicts on your own.",
-                "red",
+        with _PRINT_LOCK:
+            print(colored("Failed to push branch due to error:", "red"))
+            print(colored(str(e), "yellow"))
+            print(
+                colored(
+                    "Aborting cascade for this branch. "
+                    "Please resolve conflicts on your own.",
+                    "red",
+                )
             )
-        )
 
 def rebase_onto(repo: git.Repo, new_base: str, feature_branch: str) -> str:
     """
     Efficiently rebase feature branch onto new base branch.
     """
     rebase_cmd_str = f"git rebase -i --reapply-cherry-picks --fork-point {new_base} {feature_branch}"
-    print(rebase_cmd_str)
+    locked_print(rebase_cmd_str)
     repo.git.rebase(
             "--reapply-cherry-picks", "--fork-point", new_base, feature_branch # , "--rebase-merges"  # TODO(carden): Investigate pros/cons of rebase-merges.
     )
@@ -193,13 +349,18 @@ def rebase_onto(repo: git.Repo, new_base: str, feature_branch: str) -> str:
 
 
 def get_commit_for_branch(branch):
-    # print(f"Getting commit for branch: {branch}")
-    commit = branch.commit
-    # Deal with the case where merges are present.
-    while len(commit.parents) > 1:
-        commit = commit.parents[0]  # Follow the first parent
-    # print(f"Commit for branch {branch} is: {commit}")
-    return commit
+    """
+    Get the newest non-merge commit on the first-parent history of a branch.
+    A single `git rev-list` call walks past any merges, instead of GitPython
+    loading each parent commit object along the way.
+
+    :input branch: GitPython Branch object.
+
+    :return: String sha of the commit.
+    """
+    return branch.repo.git.rev_list(
+        "--first-parent", "--no-merges", "-n", "1", branch_name(branch)
+    ).strip()
 
 
 def print_tree(
@@ -207,49 +368,46 @@ def print_tree(
     current_branch_name,
     depth,
     repo: git.Repo,
-    cascade=False,
     color=True,
-    push_updates=False,
+    ahead_behind=None,
+    meta=None,
+    active_branch=None,
+    counts=True,
 ):
     """
-    Prints the git flow dependency tree recursively.
+    Prints the git flow dependency tree, walking it with an explicit stack so
+    deep branch stacks don't pay for, or run out of, Python frames.
     Ex:
      master
        |-> my_feature_branch_0
          |-> my_current_feature_branch *
-    Will terminate when a branch that is not in the dag is found or when there
-    are no remaining child branches for teh current branch.
+    Branches that are not in the dag are printed as leaves.
 
     :input dag: The gitflow graph that tracks dependencies.
-    :input current_branch_name: String name of the branch for the current
-                                recursive call.
-    :input depth: Integer indicating the depth of the current tree.
+    :input current_branch_name: String name of the branch to start from.
+    :input depth: Integer indicating the depth of the starting branch. At
+                  depth 0 the starting branch itself is printed, otherwise
+                  only its descendants are.
     :input repo: GitPython repo object handle for dealing with git metadata.
-    :input cascade: Boolean that, when True, will cause cascaded rebases to
-                    occur, rebasing each child branch onto the parent branch
-                    via `git pull --rebase [parent_branch]`.
-                    Defaults to False.
+    :input ahead_behind: Optional precomputed map of branch name to
+                         (ahead, behind) counts from `build_ahead_behind_map`.
+    :input meta: Optional branch metadata returned by `build_git_dag`.
+    :input active_branch: The currently checked out branch, which is printed
+                          differently.
+    :input counts: When False, only show whether each branch is behind its
+                   parent instead of counting commits.
     """
-    # Print the active branch differently
-    active_branch = active_branch_from_repo(repo)
     # Do not print branch if it is not in the flow dag.
     if current_branch_name not in dag:
-        return True
+        return
+    no_color = not color
     if depth == 0:
-        print(create_branch_str(current_branch_name, active_branch, depth, no_color=not color))
-        return print_tree(
-            dag,
-            current_branch_name,
-            depth + 1,
-            repo,
-            cascade=cascade,
-            color=color,
-            push_updates=push_updates,
-        )
-    # Recurively print branches in the flow dag.
-    for branch in dag[current_branch_name]:
-        # print(f"dag for current branch: {current_branch_name}")
-        # print(dag[current_branch_name])
+        print(create_branch_str(current_branch_name, active_branch, depth, no_color=no_color))
+        depth += 1
+    # Children are pushed in reverse so they pop off in dag order.
+    stack = [(branch, depth) for branch in reversed(dag[current_branch_name])]
+    while stack:
+        branch, depth = stack.pop()
         bname = branch_name(branch)
         # Print the final branch string to terminal.
         print(
@@ -257,31 +415,193 @@ def print_tree(
                 bname,
                 active_branch,
                 depth,
-                branch_name(branch.tracking_branch()),
+                tracking_branch_name(branch, meta),
+                repo,
+                no_color=no_color,
+                ahead_behind=ahead_behind,
+                counts=counts,
+            )
+        )
+        # Only descend into branches that are in the dag, so dead subtrees
+        # never get pushed onto the stack.
+        if bname in dag:
+            stack.extend((child, depth + 1) for child in reversed(dag[bname]))
+
+
+class WorktreePool:
+    """
+    Hands out scratch worktrees so concurrent rebases each get their own HEAD
+    and index instead of fighting over the main checkout. Worktrees are created
+    by `reserve` before any rebase starts, reused across cascade levels
+    and removed by `close`. Git reads the metadata of every worktree while it
+    rebases, so adding one while another worktree is busy races with it.
+    """
+
+    def __init__(self, repo: git.Repo):
+        self.repo = repo
+        self._free = queue.Queue()
+        self._created = []
+        self._lock = threading.Lock()
+        self._tmp_dir = None
+
+    def reserve(self, count: int) -> None:
+        """
+        Make sure at least `count` worktrees exist. Must not be called while
+        a rebase is running in any of them.
+        """
+        with self._lock:
+            while len(self._created) < count:
+                if self._tmp_dir is None:
+                    self._tmp_dir = tempfile.TemporaryDirectory(prefix="gitflow-cascade-")
+                path = os.path.join(self._tmp_dir.name, str(len(self._created)))
+                self.repo.git.worktree("add", "--detach", path)
+                worktree = git.Repo(path)
+                self._created.append(worktree)
+                self._free.put(worktree)
+
+    def acquire(self) -> git.Repo:
+        # Blocks until another rebase releases its worktree.
+        return self._free.get()
+
+    def release(self, worktree: git.Repo) -> None:
+        try:
+            # Detach so the branch is free to be checked out elsewhere again.
+            worktree.git.checkout("--detach")
+        except git.GitCommandError:
+            # Most likely a rebase that was never aborted, clear it so the
+            # worktree is usable again.
+            try:
+                worktree.git.rebase(abort=True)
+            except git.GitCommandError:
+                pass
+            worktree.git.checkout("--force", "--detach")
+        finally:
+            # Always hand the worktree back, other rebases in the level may be
+            # waiting on it in `acquire`.
+            self._free.put(worktree)
+
+    def close(self) -> None:
+        if not self._created:
+            return
+        for worktree in self._created:
+            worktree.close()
+            try:
+                self.repo.git.worktree("remove", "--force", worktree.working_tree_dir)
+            except git.GitCommandError:
+                pass
+        self._created = []
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+            self._tmp_dir = None
+        self.repo.git.worktree("prune")
+
+
+def cascade_level(
+    level: list,
+    repo: git.Repo,
+    worktrees: WorktreePool,
+    active_branch=None,
+    color: bool = True,
+    push_updates: bool = False,
+    counts: bool = True,
+    ahead_behind=None,
+    results=None,
+    post_state=None,
+    max_workers: int = None,
+) -> list:
+    """
+    Rebase every branch in one level of the dag onto its parent concurrently.
+    Branches that `ahead_behind` shows are not behind their parent already
+    contain it, and are skipped up front. Siblings never share a ref, so each
+    remaining rebase runs in its own worktree. A level with a single branch
+    left to rebase has nothing to run alongside, so it is rebased in the main
+    worktree, as is the branch checked out there, since git refuses to check
+    a branch out twice.
+
+    :input level: List of (parent branch name, branch name, depth) tuples.
+    :input repo: GitPython repo object handle for dealing with git metadata.
+    :input worktrees: Pool of scratch worktrees to run the rebases in.
+    :input active_branch: The branch checked out in the main worktree.
+    :input push_updates: Force push each branch after a successful rebase.
+    :input ahead_behind: Optional map of branch name to (ahead, behind) counts
+                         that are still valid for this level.
+    :input results: Optional dict that is filled with branch name to
+                    (new parent sha, new branch sha) for every branch the
+                    rebase actually moved.
+    :input post_state: Optional dict that is filled with branch name to
+                       (ahead, behind) counts for every branch the rebase
+                       moved, taken right after its rebase.
+    :input max_workers: Number of rebases to run at once. Defaults to the
+                        number of CPUs.
+
+    :return: List of branch names that were rebased successfully.
+    """
+    active_bname = branch_name(active_branch) if active_branch is not None else None
+
+    def print_child(parent_bname, bname, depth):
+        print(
+            create_branch_str(
+                bname,
+                active_branch,
+                depth,
+                parent_bname,
                 repo,
                 no_color=not color,
+                ahead_behind=ahead_behind,
+                counts=counts,
             )
         )
 
-        # Perform the cascaded rebase if specified.
-        if cascade:
-            if repo is None:
-                raise CascadeException("Must also supply a repo!")
+    # Screen out the branches with nothing to rebase first, so they are not
+    # counted when deciding on, and reserving, scratch worktrees.
+    skipped = set()
+    to_rebase = []
+    for parent_bname, bname, depth in level:
+        if ahead_behind and bname in ahead_behind and ahead_behind[bname][1] == 0:
+            print_child(parent_bname, bname, depth)
+            print(f"{bname} already contains {parent_bname}, skipping rebase.")
+            if push_updates:
+                force_push_no_verify(repo, bname)
+            skipped.add(bname)
+        else:
+            to_rebase.append((parent_bname, bname, depth))
+    use_worktrees = len(to_rebase) > 1
+
+    def rebase_child(parent_bname, bname, depth):
+        with _PRINT_LOCK:
+            print_child(parent_bname, bname, depth)
             print(
                 "Rebasing {cur_branch} onto {parent_branch}...".format(
-                    cur_branch=bname, parent_branch=branch_name(branch.tracking_branch())
+                    cur_branch=bname, parent_branch=parent_bname
                 )
             )
-            try:
-                rebase_cmd_str = rebase_onto(
-                    repo,
-                    new_base=branch_name(branch.tracking_branch()),
-                    feature_branch=bname,
-                )
-                print(f"Rebase command: {rebase_cmd_str}")
-                if push_updates:
-                    force_push_no_verify(repo, bname)
-            except git.GitCommandError as e:
+        if use_worktrees and bname != active_bname:
+            worktree = worktrees.acquire()
+        else:
+            worktree = repo
+        try:
+            # Repo.rev_parse goes through GitPython's persistent cat-file
+            # process, which is not safe to share between threads. Each
+            # `repo.git` call runs its own git process instead.
+            old_sha = repo.git.rev_parse(bname)
+            rebase_cmd_str = rebase_onto(worktree, new_base=parent_bname, feature_branch=bname)
+            locked_print(f"Rebase command: {rebase_cmd_str}")
+            parent_sha, new_sha = repo.git.rev_parse(parent_bname, bname).split()
+            if results is not None and new_sha != old_sha:
+                results[bname] = (parent_sha, new_sha)
+                # Count here, in parallel, so the status shown after the
+                # cascade needs nothing from git.
+                if post_state is not None:
+                    cur_ahead, parent_ahead = commit_delta_by_branch_name(
+                        bname, parent_bname, repo
+                    )
+                    if cur_ahead is not None and parent_ahead is not None:
+                        post_state[bname] = (cur_ahead, parent_ahead)
+            if push_updates:
+                force_push_no_verify(worktree, bname)
+            return True
+        except git.GitCommandError as e:
+            with _PRINT_LOCK:
                 print(colored("Failed cascade due to error:", "red"))
                 print(colored(str(e), "yellow"))
                 print(
@@ -292,20 +612,54 @@ def print_tree(
                     )
                 )
                 print("Continuing to next subtree...")
-                abort_reabse(repo)
-                continue
-        leaf_node_reached = print_tree(
-            dag,
-            bname,
-            depth + 1,
-            repo,
-            cascade=cascade,
-            color=color,
-            push_updates=push_updates,
-        )
-        if not leaf_node_reached:
+            abort_reabse(worktree)
             return False
-    return True
+        finally:
+            if worktree is not repo:
+                worktrees.release(worktree)
+
+    max_workers = max_workers or os.cpu_count()
+    if use_worktrees:
+        worktrees.reserve(
+            min(max_workers, sum(1 for _, bname, _ in to_rebase if bname != active_bname))
+        )
+    succeeded = set()
+    if to_rebase:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(executor.submit(rebase_child, *entry), entry[1]) for entry in to_rebase]
+        for future, bname in futures:
+            e = future.exception()
+            if e is not None:
+                locked_print(colored("Failed cascade of {} due to error:".format(bname), "red"))
+                locked_print(colored(str(e), "yellow"))
+            elif future.result():
+                succeeded.add(bname)
+    return [bname for _, bname, _ in level if bname in skipped or bname in succeeded]
+
+
+def _load_tracking_map(repo):
+    """
+    List every local branch along with its upstream in a single
+    `git for-each-ref` call, instead of GitPython materializing each branch
+    and parsing the config again for each `tracking_branch()`.
+
+    :input repo: GitPython repo object handle for dealing with git metadata.
+
+    :return: A dict of key, branch name, to string, tracking branch name, or
+             None when the branch has no upstream. Local upstreams are named
+             like the branch, remote ones are prefixed with the remote, e.g.
+             "origin/master".
+    """
+    # `lstrip=2` rather than `short` so names never get disambiguated into
+    # e.g. "heads/master" when a tag shares the branch name.
+    out = repo.git.for_each_ref(
+        "--format=%(refname:lstrip=2)\t%(upstream:lstrip=2)", "refs/heads"
+    )
+    tracking_map = {}
+    for line in out.splitlines():
+        bname, _, tbname = line.partition("\t")
+        tracking_map[bname] = tbname or None
+    return tracking_map
 
 
 def build_git_dag(r):
@@ -315,22 +669,88 @@ def build_git_dag(r):
     :input repo: The GitPython repository handle.
 
     :return: A dict of key, branch name, to list, GitPython branch objects.
+             A list of root branch names.
+             A dict of key, branch name, to dict of branch metadata: the
+             "tracking" branch name (or None) and the GitPython "ref".
     """
     # Key branch name to list of child branches.
-    dag = defaultdict(list)
+    dag = {}
     roots = []
-    for b in r.branches:
-        bname = branch_name(b)
-        dag.setdefault(bname, [])
-        tb = b.tracking_branch()
-        if tb:
-            tbname = branch_name(tb)
+    meta = {}
+    for bname, tbname in _load_tracking_map(r).items():
+        # Head objects are lazy handles, nothing is read until they are used.
+        b = git.Head(r, git.Head.to_full_path(bname))
+        if bname not in dag:
+            dag[bname] = []
+        meta[bname] = {"tracking": tbname, "ref": b}
+        if tbname:
             if tbname.startswith("origin"):
                 roots.append(tbname)
-            dag[tbname].append(b)
+            children = dag.get(tbname)
+            if children is None:
+                children = dag[tbname] = []
+            children.append(b)
         else:
             roots.append(bname)
-    return dag, roots
+    return dag, roots, meta
+
+
+def build_git_dag_from(r, root_bname):
+    """
+    Build only the part of the gitflow branch dependency graph that descends
+    from a single branch. The upstreams still come from one batched listing,
+    but GitPython handles and dag entries are only created for the subtree.
+
+    :input repo: The GitPython repository handle.
+    :input root_bname: String name of the branch to start from.
+
+    :return: The same dag, roots and meta as `build_git_dag`, restricted to
+             the subtree of `root_bname`, which is the only root.
+    """
+    tracking_map = _load_tracking_map(r)
+    # Invert the upstream map once so each level is a dict lookup.
+    children_by_parent = {}
+    for bname, tbname in tracking_map.items():
+        if tbname:
+            children_by_parent.setdefault(tbname, []).append(bname)
+
+    dag = {}
+    meta = {}
+    if root_bname in tracking_map or root_bname in children_by_parent:
+        dag[root_bname] = []
+    if root_bname in tracking_map:
+        meta[root_bname] = {
+            "tracking": tracking_map[root_bname],
+            "ref": git.Head(r, git.Head.to_full_path(root_bname)),
+        }
+    # Appending while iterating walks the subtree breadth first.
+    to_visit = [root_bname]
+    for parent_bname in to_visit:
+        for bname in children_by_parent.get(parent_bname, []):
+            # Guard against upstream cycles, e.g. two branches tracking each other.
+            if bname in meta:
+                continue
+            b = git.Head(r, git.Head.to_full_path(bname))
+            meta[bname] = {"tracking": parent_bname, "ref": b}
+            dag[parent_bname].append(b)
+            dag[bname] = []
+            to_visit.append(bname)
+    return dag, [root_bname], meta
+
+
+def _descendant_names(dag: dict, roots: list):
+    """
+    Yield the name of every branch below `roots` in the dag.
+    """
+    seen = set(roots)
+    to_visit = list(roots)
+    while to_visit:
+        for child in dag.get(to_visit.pop(), []):
+            child_bname = branch_name(child)
+            if child_bname not in seen:
+                seen.add(child_bname)
+                to_visit.append(child_bname)
+                yield child_bname
 
 
 def print_dag(
@@ -340,19 +760,135 @@ def print_dag(
     cascade: bool,
     color: bool = True,
     push_updates: bool = False,
+    meta: dict = None,
+    counts: bool = True,
+    prev_counts: dict = None,
 ):
+    """
+    Print, or cascade rebases down, the gitflow trees starting at each root.
+
+    :input prev_counts: Optional map of branch name to (ahead, behind) counts
+                        known to still be valid, as returned by a previous
+                        call. Git is only asked again when a branch is missing.
+
+    :return: Map of branch name to (ahead, behind) counts that are valid once
+             this call returns.
+    """
+    # Roots that are not in the flow dag print nothing, so don't pay for the
+    # counts or for resolving HEAD on their behalf.
+    roots = [root_branch_name for root_branch_name in roots if root_branch_name in dag]
+    if not roots:
+        return prev_counts if prev_counts is not None else {}
+    if cascade:
+        return cascade_dag(
+            dag, roots, repo, color=color, push_updates=push_updates, counts=counts
+        )
+    # Gather every branch's divergence from its upstream, and resolve HEAD,
+    # once for all of the trees.
+    # Only the branches that get printed need a count.
+    ahead_behind = prev_counts
+    if ahead_behind is None or any(
+        bname not in ahead_behind for bname in _descendant_names(dag, roots)
+    ):
+        ahead_behind = build_ahead_behind_map(repo)
+    active_branch = active_branch_from_repo(repo)
     # Begin traversing the tree from the top level branches.
     for root_branch_name in roots:
-        if not print_tree(
+        print_tree(
             dag,
             root_branch_name,
             depth=0,
             repo=repo,
-            cascade=cascade,
             color=color,
-            push_updates=push_updates,
-        ):
-            return
+            ahead_behind=ahead_behind,
+            meta=meta,
+            active_branch=active_branch,
+            counts=counts,
+        )
+    return ahead_behind
+
+
+def cascade_dag(
+    dag: dict,
+    roots: list,
+    repo: git.Repo,
+    color: bool = True,
+    push_updates: bool = False,
+    counts: bool = True,
+    max_workers: int = None,
+):
+    """
+    Rebase each child branch onto its parent, one dag level at a time, running
+    the rebases within a level in parallel. A branch that fails to rebase is
+    aborted and its subtree is skipped. The branch that was checked out is
+    checked out again once the cascade is done.
+
+    :input dag: The gitflow graph that tracks dependencies.
+    :input roots: List of branch names to cascade from.
+    :input repo: GitPython repo object handle for dealing with git metadata.
+    :input max_workers: Number of rebases to run at once within a level.
+                        Defaults to the number of CPUs.
+
+    :return: Map of branch name to (ahead, behind) counts that are valid
+             after the cascade. Branches the cascade moved are counted right
+             after their rebase, the rest keep the counts taken before it.
+    """
+    if repo is None:
+        raise CascadeException("Must also supply a repo!")
+    active_branch = active_branch_from_repo(repo)
+    # Snapshot the counts up front. Entries are dropped as soon as a rebase
+    # moves the branch or its parent, so whatever is left can be reused.
+    ahead_behind = build_ahead_behind_map(repo)
+    results = {}
+    post_state = {}
+    worktrees = WorktreePool(repo)
+    try:
+        for root_branch_name in roots:
+            if root_branch_name not in dag:
+                continue
+            print(create_branch_str(root_branch_name, active_branch, 0, no_color=not color))
+            level = [(root_branch_name, branch_name(b), 1) for b in dag[root_branch_name]]
+            while level:
+                # Once a parent has moved, refresh the counts in one batched
+                # call so the level can be screened for rebases with nothing
+                # to do.
+                if any(parent_bname in results for parent_bname, _, _ in level):
+                    ahead_behind.update(build_ahead_behind_map(repo))
+                rebased = cascade_level(
+                    level,
+                    repo,
+                    worktrees,
+                    active_branch=active_branch,
+                    color=color,
+                    push_updates=push_updates,
+                    counts=counts,
+                    ahead_behind=ahead_behind,
+                    results=results,
+                    post_state=post_state,
+                    max_workers=max_workers,
+                )
+                for bname in rebased:
+                    if bname not in results:
+                        continue
+                    ahead_behind.pop(bname, None)
+                    for child in dag.get(bname, []):
+                        ahead_behind.pop(branch_name(child), None)
+                ahead_behind.update(post_state)
+                level = [
+                    (bname, branch_name(child), depth + 1)
+                    for _, bname, depth in level
+                    if bname in rebased
+                    for child in dag.get(bname, [])
+                ]
+    finally:
+        worktrees.close()
+        # Single branch levels are rebased in the main worktree, which leaves
+        # it on whichever branch went last.
+        if active_branch is not None:
+            current_branch = active_branch_from_repo(repo)
+            if current_branch is None or branch_name(current_branch) != branch_name(active_branch):
+                repo.git.checkout(branch_name(active_branch))
+    return ahead_behind
 
 
 def checkout(branch_name, repo, fail=True):
@@ -375,18 +911,21 @@ def checkout(branch_name, repo, fail=True):
     return True
 
 
-def find_git_dir():
+def find_repo(path=None):
     """
-    Finds the git directory no matter where your current working directory is.
+    Finds the git repo no matter where your current working directory is.
+    GitPython walks up to the toplevel itself (worktrees included), so this
+    doesn't need to shell out to `git rev-parse --show-toplevel` first.
+
+    :input path: Directory to start searching from. Defaults to the current
+                 working directory.
+
+    :return: GitPython repo object handle.
     """
-    # Use `--show-toplevel` instead of `--git-dir` here because it is a more
-    # robust solution.
-    cmd = ["git", "rev-parse", "--show-toplevel"]
-    g = git.Git()
-    # We join with .git instead of doing `--git-dir` in our cmd because this
-    # works with worktrees, while `--git-dir` did not work with worktrees in my
-    # experience. Worst case, both work.
-    return os.path.join(g.execute(cmd), ".git")
+    try:
+        return git.Repo(path or os.getcwd(), search_parent_directories=True)
+    except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+        raise DagParseException("Must be in git directory!")
 
 
 def parse_args(argv):
@@ -417,6 +956,14 @@ def parse_args(argv):
         action="store_false",
         help="Updates the specified branch with latest origin.",
     )
+    parser.add_argument(
+        "--no-counts",
+        default=True,
+        dest="counts",
+        action="store_false",
+        help="Only show whether each branch is behind its parent instead of "
+        "how many commits each side is ahead by.",
+    )
     parser.add_argument(
         "--push",
         default=False,
@@ -428,11 +975,7 @@ def parse_args(argv):
 
 def main(argv=sys.argv[1:]):
     args = parse_args(argv)
-    git_dir = find_git_dir()
-    if not (os.path.exists(git_dir)):
-        raise DagParseException("Must be in git directory!")
-    repo = git.Repo(os.path.dirname(git_dir))
-    dag, roots = build_git_dag(repo)
+    repo = find_repo()
 
     # By default, start with the currently checked out branch.
     initial_active_branch = active_branch_from_repo(repo, verbose=True)
@@ -441,10 +984,12 @@ def main(argv=sys.argv[1:]):
         active_branch_name = branch_name(initial_active_branch)
 
     if not args.branch:
+        dag, roots, meta = build_git_dag(repo)
         args.branch = active_branch_name
     else:
-        # Branch names to start dags from.
-        roots = [args.branch]
+        # Only the tree below the given branch is shown, so skip building the
+        # rest of the dag.
+        dag, roots, meta = build_git_dag_from(repo, args.branch)
     if args.branch != active_branch_name:
         active_branch_name = args.branch
         checkout(active_branch_name, repo)
@@ -454,14 +999,33 @@ def main(argv=sys.argv[1:]):
 
     if args.cascade:
         roots = [active_branch_name]
-    print_dag(dag, roots, repo, args.cascade, color=args.color, push_updates=args.push)
+    counts_after = print_dag(
+        dag,
+        roots,
+        repo,
+        args.cascade,
+        color=args.color,
+        push_updates=args.push,
+        meta=meta,
+        counts=args.counts,
+    )
     # If performing a cascade, print out status again.
     if args.cascade:
         # If cascaded, return to the original branch.
         repo.git.checkout(initial_active_branch)
 
         print("Status after cascade:")
-        print_dag(dag, roots, repo, False, color=args.color, push_updates=False)
+        print_dag(
+            dag,
+            roots,
+            repo,
+            False,
+            color=args.color,
+            push_updates=False,
+            meta=meta,
+            counts=args.counts,
+            prev_counts=counts_after,
+        )
 
 
 if __name__ == "__main__":
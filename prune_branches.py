@@ -9,11 +9,12 @@ def branch_pattern(branch_name='.+?'):
     return re.compile(r'\|-> (?P<raw_branch_name>{branch_name}) '.format(branch_name=branch_name))
 
 
-def extract_raw_branch_name(line, pattern=branch_pattern()):
+_BRANCH_RE = branch_pattern()
+
+
+def extract_raw_branch_name(line, pattern=_BRANCH_RE):
     m = pattern.search(line)
-    if not m:
-        return None
-    return m.group('raw_branch_name')
+    return m.group('raw_branch_name') if m else None
 
 
 def main(argv=sys.argv[1:]):
@@ -22,13 +23,11 @@ def main(argv=sys.argv[1:]):
 
     # Create a lookup from the gitflow status output to raw branch name.
     # This will allow us to select a line from the gitflow status and map it to a branch to delete.
-    gf_to_raw_branch_map = {}
-    gf_status_options = []
-    for line in gf_status:
-        raw_branch_name = extract_raw_branch_name(line)
-        if raw_branch_name is None:
-            continue
-        gf_to_raw_branch_map[line] = raw_branch_name
+    gf_to_raw_branch_map = {
+        line: raw_branch_name
+        for line, raw_branch_name in zip(gf_status, map(extract_raw_branch_name, gf_status))
+        if raw_branch_name is not None
+    }
 
     selections = pick(options=gf_status,
                   title=("Mark all branches you would like to delete.\n"
@@ -36,6 +35,7 @@ def main(argv=sys.argv[1:]):
                          "Select multiple with [space]."),
                   multiselect=True,
                   indicator='->')
+    to_delete = []
     for line, _ in selections:
       # Hardcode that we skip the remote branches if they are selected.
       if re.match(r'\s*origin\/', line):
@@ -44,9 +44,11 @@ def main(argv=sys.argv[1:]):
       if line not in gf_to_raw_branch_map:
         print(f"Warning! Could not find raw branch name for {line}")
         continue
-      raw_branch_name = gf_to_raw_branch_map[line]
-      # Delete the branch.
-      subprocess.check_call(f'git branch -D {raw_branch_name}', shell=True)
+      to_delete.append(gf_to_raw_branch_map[line])
+    # Delete all of the branches with a single git call, without a shell in
+    # between to mangle branch names.
+    if to_delete:
+      subprocess.check_call(['git', 'branch', '-D', *to_delete])
 
     return 0
 
@@ -1,30 +1,110 @@
 # System imports
+import functools
 import tempfile
 import unittest
-from typing import Optional
 
 # Third-party imports
 import pytest
-from git import Repo
+import termcolor
+from git import GitCommandError, Repo
 
 # Cruise imports
 import gitflow as gf
 
+COMMITTER = "GitFlow Test <gitflow@example.com>"
+
+
+def _fast_import_data(text: str) -> bytes:
+    data = text.encode()
+    return b"data %d\n%s\n" % (len(data), data)
+
+
+def fast_import_stream(history: list) -> bytes:
+    """
+    Encode a history as a single `git fast-import` stream, so a fixture is
+    built with one git invocation instead of an index update per commit.
+
+    :input history: List of (branch, start branch, file path, content, commit
+                    message) tuples, applied in order. Each commit writes one
+                    file. The first commit on a branch is made on top of the
+                    tip of the start branch at that point.
+    """
+    stream = []
+    tips = {}
+    for mark, (branch, start_branch, file_path, content, commit_msg) in enumerate(history, 1):
+        stream.append(b"commit refs/heads/%s\nmark :%d\n" % (branch.encode(), mark))
+        # Fixed, increasing timestamps keep the fixtures reproducible.
+        stream.append(b"committer %s %d +0000\n" % (COMMITTER.encode(), 1700000000 + mark))
+        stream.append(_fast_import_data(commit_msg))
+        parent = tips.get(branch, tips.get(start_branch))
+        if parent is not None:
+            stream.append(b"from :%d\n" % parent)
+        stream.append(b"M 100644 inline %s\n" % file_path.encode())
+        stream.append(_fast_import_data(content))
+        tips[branch] = mark
+    return b"".join(stream)
+
+
+def clear_color_caches():
+    """
+    Forget the color decision, which is otherwise made once per run, so a test
+    can change the environment termcolor reads.
+    """
+    gf._color_codes.cache_clear()
+    # Newer termcolor versions cache their own decision as well.
+    can_colorize = getattr(termcolor, "can_colorize", None)
+    if hasattr(can_colorize, "cache_clear"):
+        can_colorize.cache_clear()
+
 
 class GitRepoTestEnvironment:
+    # Key branch name to the local branch it tracks.
+    upstreams = {}
+    # Branch left checked out once the repo is configured.
+    checkout_branch = "master"
 
     def setup_repo(self):
         # Create a temporary directory for the Git repository
         self.temp_dir = tempfile.TemporaryDirectory()
         self.repo = Repo.init(self.temp_dir.name)
         self.repo_path = self.temp_dir.name
+        # Rebases need a committer identity, don't rely on the global config.
+        with self.repo.config_writer() as config:
+            config.set_value("user", "name", "GitFlow Test")
+            config.set_value("user", "email", "gitflow@example.com")
         self.configure_repo()
 
+    @classmethod
+    def history(cls) -> list:
+        """
+        Implement this method to describe the commits of the repo, see
+        `fast_import_stream`.
+        """
+        return []
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _import_stream(cls) -> bytes:
+        return fast_import_stream(cls.history())
+
     def configure_repo(self):
         """
-        Implement this method to create the state of the repo
+        Create the state of the repo from `history` with a single
+        `git fast-import`, then set up the upstreams and check out a branch.
         """
-        return
+        if not self.history():
+            return
+        repo = self.repo
+        with tempfile.TemporaryFile() as stream:
+            stream.write(self._import_stream())
+            stream.seek(0)
+            repo.git.fast_import("--quiet", istream=stream)
+        with repo.config_writer() as config:
+            for branch, upstream in self.upstreams.items():
+                config.set_value(f'branch "{branch}"', "remote", ".")
+                config.set_value(f'branch "{branch}"', "merge", f"refs/heads/{upstream}")
+        # Force, the index and working tree are still empty after the import.
+        repo.git.checkout("--force", self.checkout_branch)
 
     def teardown_repo(self):
         if self.temp_dir is not None:
@@ -40,132 +120,102 @@ class GitRepoTestEnvironment:
     def dag(self) -> dict:
         if self.repo is None:
             return {}
-        dag, _ = gf.build_git_dag(self.repo)
+        dag, _, _ = gf.build_git_dag(self.repo)
         return dag
 
     @property
     def roots(self) -> list:
         if self.repo is None:
             return []
-        _, roots = gf.build_git_dag(self.repo)
+        _, roots, _ = gf.build_git_dag(self.repo)
         return roots
 
 
-def create_dummy_file_and_add_to_repo(
-    repo: Repo,
-    file_path: str,
-    content: str,
-    commit_msg: Optional[str] = None,
-):
-    if commit_msg is None:
-        commit_msg = f"Added {file_path} to the repository"
-    with open(file_path, "w") as file:
-        file.write(content)
-    repo.index.add([file_path])
-    repo.index.commit(commit_msg)
-
-
 class GitRepoDepth2FeatureTree(GitRepoTestEnvironment):
-    def configure_repo(self):
-        """
-        Configure the repository with a depth of 2 feature tree.
-        """
-        repo = self.repo
-        file_path = f"{self.temp_dir.name}/file.txt"
-        # Setup the initial Git environment
-        create_dummy_file_and_add_to_repo(
-            repo,
-            file_path=file_path,
-            content="Initial content",
-            commit_msg="Initial commit on master",
-        )
+    """
+    Configure the repository with a depth of 2 feature tree.
+    """
 
-        # Create branches and commits
-        master = repo.heads.master  # master branch
-        file_path = f"{self.temp_dir.name}/fileA.txt"
-        branch_a = repo.create_head("A", master.commit)
-        repo.git.branch("A", "--set-upstream-to", "master")
-
-        # Checkout branch A and make commits
-        branch_a.checkout()
-        create_dummy_file_and_add_to_repo(
-            repo,
-            file_path=file_path,
-            content="\nContent on branch A",
-            commit_msg="First commit on A",
-        )
-        create_dummy_file_and_add_to_repo(
-            repo,
-            file_path=file_path,
-            content="\nNext content on branch A",
-            commit_msg="Second commit on A",
-        )
-        branch_b = repo.create_head("B", branch_a.commit)
-        repo.git.branch("B", "--set-upstream-to", "A")
-
-        # Checkout branch B and make a commit
-        branch_b.checkout()
-        file_path = f"{self.temp_dir.name}/fileB.txt"
-        create_dummy_file_and_add_to_repo(
-            repo,
-            file_path=file_path,
-            content="\nContent on branch B",
-            commit_msg="First commit on B",
-        )
+    upstreams = {"A": "master", "B": "A"}
+    checkout_branch = "B"
+
+    @classmethod
+    def history(cls) -> list:
+        return [
+            ("master", None, "file.txt", "Initial content", "Initial commit on master"),
+            ("A", "master", "fileA.txt", "\nContent on branch A", "First commit on A"),
+            ("A", "master", "fileA.txt", "\nNext content on branch A", "Second commit on A"),
+            ("B", "A", "fileB.txt", "\nContent on branch B", "First commit on B"),
+        ]
 
 
 class GitRepoDepth2FeatureTreeWithUpdatedMaster(GitRepoDepth2FeatureTree):
-    def configure_repo(self):
-        """
-        Configure the repository with a depth of 2 feature tree.
-        Update the master branch so that branch A is several commits behind master.
-        """
-        super().configure_repo()
-        repo = self.repo
-        # Update master without updating child branches a and b.
-        master = repo.heads.master  # master branch
-        master.checkout()
-        file_path = f"{self.temp_dir.name}/file2.txt"
-        # Setup the initial Git environment
-        create_dummy_file_and_add_to_repo(
-            repo,
-            file_path=file_path,
-            content="New content on master",
-            commit_msg="Updated master branch 1",
-        )
-        create_dummy_file_and_add_to_repo(
-            repo,
-            file_path=file_path,
-            content="Another new content on master",
-            commit_msg="Updated master branch 2",
-        )
+    """
+    Configure the repository with a depth of 2 feature tree.
+    Update the master branch so that branch A is several commits behind master.
+    """
+
+    checkout_branch = "master"
+    # Update master without updating child branches a and b.
+    master_updates = [
+        ("master", None, "file2.txt", "New content on master", "Updated master branch 1"),
+        (
+            "master",
+            None,
+            "file2.txt",
+            "Another new content on master",
+            "Updated master branch 2",
+        ),
+    ]
+
+    @classmethod
+    def history(cls) -> list:
+        return super().history() + cls.master_updates
 
 
 class GitRepoDepth2FeatureTreeWithUpdatedMasterWithRebaseConflict(GitRepoDepth2FeatureTree):
-    def configure_repo(self):
-        """
-        Configure the repository with a depth of 2 feature tree.
-        Update the master branch so that branch A is several commits behind master.
-        Update the same file as other branches to create a rebase conflict between branch A and branch B.
-        """
-        super().configure_repo()
-        repo = self.repo
+    """
+    Configure the repository with a depth of 2 feature tree.
+    Update the master branch so that branch A is several commits behind master.
+    Update the same file as other branches to create a rebase conflict between branch A and branch B.
+    """
+
+    checkout_branch = "master"
+
+    @classmethod
+    def history(cls) -> list:
         # Update master without updating child branches a and b.
-        master = repo.heads.master  # master branch
-        master.checkout()
-        file_path = f"{self.temp_dir.name}/fileA.txt"
-        # Setup the initial Git environment
-        create_dummy_file_and_add_to_repo(
-            repo,
-            file_path=file_path,
-            content="New content on master",
-            commit_msg="Updated master branch 1",
-        )
-        create_dummy_file_and_add_to_repo(
-            repo,
-            file_path=file_path,
-            content="Another new content on master",
-            commit_msg="Updated master branch 2",
+        return super().history() + [
+            ("master", None, "fileA.txt", "New content on master", "Updated master branch 1"),
+            (
+                "master",
+                None,
+                "fileA.txt",
+                "Another new content on master",
+                "Updated master branch 2",
+            ),
+        ]
+
+
+class GitRepoSiblingFeatureTreeWithUpdatedMaster(GitRepoDepth2FeatureTreeWithUpdatedMaster):
+    """
+    Configure the repository with a depth of 2 feature tree and two more
+    branches, C and D, next to branch A.
+    Update the master branch so that branches A, C and D are behind master.
+    """
+
+    upstreams = {"A": "master", "B": "A", "C": "master", "D": "master"}
+
+    @classmethod
+    def history(cls) -> list:
+        # Branch C and D off before master is updated.
+        return (
+            GitRepoDepth2FeatureTree.history()
+            + [
+                ("C", "master", "fileC.txt", "\nContent on branch C", "First commit on C"),
+                ("D", "master", "fileD.txt", "\nContent on branch D", "First commit on D"),
+            ]
+            + cls.master_updates
         )
 
 
@@ -177,12 +227,85 @@ class TestGitOperations(GitRepoDepth2FeatureTree):
         expected_roots = git_repo.roots
         expected_dag = git_repo.dag
         repo = git_repo.repo
-        dag, roots = gf.build_git_dag(repo)
+        dag, roots, meta = gf.build_git_dag(repo)
         assert expected_roots
         assert expected_dag
         assert roots == expected_roots
         assert dag == expected_dag
-        gf.print_dag(dag, roots, repo, cascade=False, push_updates=False)
+        assert meta["A"]["tracking"] == "master"
+        assert meta["B"]["tracking"] == "A"
+        assert meta["master"]["tracking"] is None
+        gf.print_dag(dag, roots, repo, cascade=False, push_updates=False, meta=meta)
+
+    def test_build_git_dag_from_subtree(self, git_repo: GitRepoDepth2FeatureTree):
+        repo = git_repo.repo
+        full_dag, _, full_meta = gf.build_git_dag(repo)
+        dag, roots, meta = gf.build_git_dag_from(repo, "A")
+        assert roots == ["A"]
+        assert dag == {"A": full_dag["A"], "B": full_dag["B"]}
+        # Heads compare by path, so this checks the refs as well as the upstreams.
+        assert meta == {bname: full_meta[bname] for bname in ("A", "B")}
+        assert gf.build_git_dag_from(repo, "does-not-exist") == ({}, ["does-not-exist"], {})
+
+    def test_print_dag_output(self, git_repo: GitRepoDepth2FeatureTree, capsys):
+        repo = git_repo.repo
+        dag, roots, meta = gf.build_git_dag(repo)
+        gf.print_dag(dag, roots, repo, cascade=False, color=False, meta=meta)
+        assert capsys.readouterr().out.splitlines() == [
+            " master",
+            "   |-> A  (-0, +2)",
+            "     |-> B  (-0, +1) *(active branch)",
+        ]
+
+    def test_create_branch_str_colors(self, git_repo: GitRepoDepth2FeatureTree, monkeypatch):
+        repo = git_repo.repo
+        monkeypatch.delenv("ANSI_COLORS_DISABLED", raising=False)
+        monkeypatch.delenv("NO_COLOR", raising=False)
+        monkeypatch.setenv("FORCE_COLOR", "1")
+        clear_color_caches()
+        branch_str = gf.create_branch_str("B", repo.active_branch, 2, "A", repo)
+        green, reset = "\x1b[32m", "\x1b[0m"
+        assert branch_str == f"{green}     |-> B  (-0, {green}+1{reset}) *(active branch){reset}"
+        # termcolor's switches still turn the colors off.
+        monkeypatch.setenv("NO_COLOR", "1")
+        clear_color_caches()
+        branch_str = gf.create_branch_str("B", repo.active_branch, 2, "A", repo)
+        assert branch_str == "     |-> B  (-0, +1) *(active branch)"
+        monkeypatch.undo()
+        clear_color_caches()
+
+    def test_print_dag_skips_unknown_roots(self, git_repo: GitRepoDepth2FeatureTree, capsys):
+        repo = git_repo.repo
+        dag, _, meta = gf.build_git_dag(repo)
+        assert gf.print_dag(dag, ["does-not-exist"], repo, cascade=False, meta=meta) == {}
+        assert capsys.readouterr().out == ""
+
+    def test_cascade_skips_up_to_date_branches(self, git_repo: GitRepoDepth2FeatureTree, capsys):
+        repo = git_repo.repo
+        dag, roots, _ = gf.build_git_dag(repo)
+        before = {bname: repo.heads[bname].commit for bname in ("A", "B")}
+        gf.print_dag(dag, roots, repo, cascade=True, push_updates=False)
+        out = capsys.readouterr().out
+        assert "A already contains master, skipping rebase." in out
+        assert "B already contains A, skipping rebase." in out
+        assert "git rebase" not in out
+        assert before == {bname: repo.heads[bname].commit for bname in ("A", "B")}
+
+    def test_get_commit_for_branch_skips_merges(self, git_repo: GitRepoDepth2FeatureTree):
+        repo = git_repo.repo
+        tip = repo.heads.B.commit
+        repo.heads.master.checkout()
+        repo.git.commit("--allow-empty", "-m", "Diverge master")
+        repo.heads.B.checkout()
+        repo.git.merge("--no-ff", "-m", "Merge master into B", "master")
+        assert repo.heads.B.commit != tip
+        assert gf.get_commit_for_branch(repo.heads.B) == tip.hexsha
+
+    def test_has_diverged(self, git_repo: GitRepoDepth2FeatureTree):
+        repo = git_repo.repo
+        assert gf.has_diverged(repo, "B", "master")
+        assert not gf.has_diverged(repo, "master", "B")
+        assert not gf.has_diverged(repo, "A", "A")
 
 
 class TestGitOperationsWithUpdatedMaster(GitRepoDepth2FeatureTreeWithUpdatedMaster):
@@ -195,7 +318,7 @@ class TestGitOperationsWithUpdatedMaster(GitRepoDepth2FeatureTreeWithUpdatedMast
         expected_roots = git_repo.roots
         expected_dag = git_repo.dag
         repo = git_repo.repo
-        dag, roots = gf.build_git_dag(repo)
+        dag, roots, meta = gf.build_git_dag(repo)
         print(roots)
         print(dag)
         assert expected_roots
@@ -211,6 +334,126 @@ class TestGitOperationsWithUpdatedMaster(GitRepoDepth2FeatureTreeWithUpdatedMast
         print("After rebase:")
         gf.print_dag(dag, roots, repo, cascade=False, push_updates=False)
 
+    def test_ahead_behind_map_matches_commit_delta(
+        self, git_repo: GitRepoDepth2FeatureTreeWithUpdatedMaster
+    ):
+        repo = git_repo.repo
+        ahead_behind = gf.build_ahead_behind_map(repo)
+        assert ahead_behind == {"A": (2, 2), "B": (1, 0)}
+        for bname, parent_bname in [("A", "master"), ("B", "A")]:
+            assert ahead_behind[bname] == gf.commit_delta_by_branch_name(bname, parent_bname, repo)
+
+    def test_print_dag_without_counts(
+        self, git_repo: GitRepoDepth2FeatureTreeWithUpdatedMaster, monkeypatch, capsys
+    ):
+        repo = git_repo.repo
+        dag, roots, meta = gf.build_git_dag(repo)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("The batched counts should be enough")
+
+        monkeypatch.setattr(gf, "commit_delta_by_branch_name", fail)
+        gf.print_dag(dag, roots, repo, cascade=False, color=False, meta=meta, counts=False)
+        assert capsys.readouterr().out.splitlines() == [
+            " master *(active branch)",
+            "   |-> A  (behind)",
+            "     |-> B  (up to date)",
+        ]
+
+    def test_cascade_rebases_every_level(
+        self, git_repo: GitRepoDepth2FeatureTreeWithUpdatedMaster, monkeypatch
+    ):
+        repo = git_repo.repo
+        dag, roots, _ = gf.build_git_dag(repo)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("A linear stack should not need scratch worktrees")
+
+        monkeypatch.setattr(gf.WorktreePool, "acquire", fail)
+        counts_after = gf.print_dag(dag, roots, repo, cascade=True, push_updates=False)
+        # Moved branches were counted after their rebase, so every count is current.
+        assert counts_after == gf.build_ahead_behind_map(repo)
+        master = repo.heads.master.commit
+        assert repo.is_ancestor(master, repo.heads.A.commit)
+        assert repo.is_ancestor(repo.heads.A.commit, repo.heads.B.commit)
+        # The originally checked out branch is restored afterwards.
+        assert repo.active_branch.name == "master"
+        assert len(repo.git.worktree("list").splitlines()) == 1
+
+    def test_status_after_cascade_does_not_call_git(
+        self, git_repo: GitRepoDepth2FeatureTreeWithUpdatedMaster, monkeypatch, capsys
+    ):
+        repo = git_repo.repo
+        # A branch outside the cascaded tree whose upstream is gone.
+        repo.create_head("G", "master")
+        repo.create_remote("origin", "/nonexistent")
+        with repo.config_writer() as config:
+            config.set_value('branch "G"', "remote", "origin")
+            config.set_value('branch "G"', "merge", "refs/heads/G")
+        dag, roots, meta = gf.build_git_dag(repo)
+        assert roots == ["origin/G", "master"]
+        counts_after = gf.print_dag(dag, ["master"], repo, cascade=True, meta=meta)
+        assert counts_after["G"] == (None, None)
+        capsys.readouterr()
+
+        def fail(*args, **kwargs):
+            raise AssertionError("Status after cascade should not call git")
+
+        monkeypatch.setattr(gf, "build_ahead_behind_map", fail)
+        monkeypatch.setattr(gf, "commit_delta_by_branch_name", fail)
+        gf.print_dag(
+            dag, roots, repo, cascade=False, color=False, meta=meta, prev_counts=counts_after
+        )
+        assert capsys.readouterr().out.splitlines() == [
+            " origin/G",
+            "   |-> G  (Upstream Branch Not Found)",
+            " master *(active branch)",
+            "   |-> A  (-0, +2)",
+            "     |-> B  (-0, +1)",
+        ]
+        # Branches that are not printed don't need counts either.
+        del counts_after["G"]
+        gf.print_dag(
+            dag, ["master"], repo, cascade=False, color=False, meta=meta, prev_counts=counts_after
+        )
+        assert len(capsys.readouterr().out.splitlines()) == 3
+
+class TestGitOperationsWithSiblings(GitRepoSiblingFeatureTreeWithUpdatedMaster):
+    def test_cascade_rebases_siblings_concurrently(
+        self, git_repo: GitRepoSiblingFeatureTreeWithUpdatedMaster
+    ):
+        repo = git_repo.repo
+        dag, roots, _ = gf.build_git_dag(repo)
+        assert sorted(gf.branch_name(child) for child in dag["master"]) == ["A", "C", "D"]
+        counts_after = gf.cascade_dag(dag, roots, repo, max_workers=3)
+        assert counts_after == gf.build_ahead_behind_map(repo)
+        master = repo.heads.master.commit
+        for bname in ("A", "C", "D"):
+            assert repo.is_ancestor(master, repo.heads[bname].commit)
+        assert repo.is_ancestor(repo.heads.A.commit, repo.heads.B.commit)
+        # The scratch worktrees are gone and the main checkout is untouched.
+        assert repo.active_branch.name == "master"
+        assert len(repo.git.worktree("list").splitlines()) == 1
+
+    def test_cascade_skips_siblings_without_worktrees(
+        self, git_repo: GitRepoSiblingFeatureTreeWithUpdatedMaster, monkeypatch, capsys
+    ):
+        repo = git_repo.repo
+        dag, roots, _ = gf.build_git_dag(repo)
+        gf.cascade_dag(dag, roots, repo, max_workers=3)
+        capsys.readouterr()
+
+        def fail(*args, **kwargs):
+            raise AssertionError("Up to date branches should not need scratch worktrees")
+
+        monkeypatch.setattr(gf.WorktreePool, "reserve", fail)
+        gf.cascade_dag(dag, roots, repo, max_workers=3)
+        out = capsys.readouterr().out
+        for bname in ("A", "C", "D"):
+            assert f"{bname} already contains master, skipping rebase." in out
+        assert "Rebasing" not in out
+
+
 class TestGitOperationsWithRebaseConflict(GitRepoDepth2FeatureTreeWithUpdatedMasterWithRebaseConflict):
     def test_rebase_aborts_with_conflict(
         self, git_repo: GitRepoDepth2FeatureTreeWithUpdatedMaster
@@ -221,7 +464,7 @@ class TestGitOperationsWithRebaseConflict(GitRepoDepth2FeatureTreeWithUpdatedMas
         expected_roots = git_repo.roots
         expected_dag = git_repo.dag
         repo = git_repo.repo
-        dag, roots = gf.build_git_dag(repo)
+        dag, roots, meta = gf.build_git_dag(repo)
         print(roots)
         print(dag)
         assert expected_roots
@@ -237,6 +480,35 @@ class TestGitOperationsWithRebaseConflict(GitRepoDepth2FeatureTreeWithUpdatedMas
         print("After rebase:")
         gf.print_dag(dag, roots, repo, cascade=False, push_updates=False)
 
+    def test_worktree_release_clears_unfinished_rebase(
+        self, git_repo: GitRepoDepth2FeatureTreeWithUpdatedMasterWithRebaseConflict
+    ):
+        repo = git_repo.repo
+        worktrees = gf.WorktreePool(repo)
+        worktrees.reserve(1)
+        try:
+            worktree = worktrees.acquire()
+            with pytest.raises(GitCommandError):
+                worktree.git.rebase("master", "A")
+            # The conflicted rebase is left in progress, as when an abort fails.
+            worktrees.release(worktree)
+            assert worktrees.acquire() is worktree
+            assert worktree.head.is_detached
+            # A is free to be checked out again.
+            repo.git.checkout("A")
+        finally:
+            worktrees.close()
+
+    def test_failed_cascade_keeps_counts(
+        self, git_repo: GitRepoDepth2FeatureTreeWithUpdatedMasterWithRebaseConflict
+    ):
+        repo = git_repo.repo
+        dag, roots, _ = gf.build_git_dag(repo)
+        before = gf.build_ahead_behind_map(repo)
+        counts_after = gf.print_dag(dag, roots, repo, cascade=True, push_updates=False)
+        # The rebase of A aborted, nothing moved so every count is still valid.
+        assert counts_after == before == gf.build_ahead_behind_map(repo)
+
 
 if __name__ == "__main__":
     unittest.main()